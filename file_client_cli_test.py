@@ -6,83 +6,116 @@ import logging
 import argparse
 import time
 import csv
-from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+from socket_tuning import tune_socket
+
+try:
+    import orjson   # opsional, parser C yang menerima bytes langsung
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 def recv_until(sock, delimiter=b"\r\n\r\n"):
     """Terima data dari socket sampai delimiter ditemukan."""
-    buffer = b""
-    while delimiter not in buffer:
+    buffer = bytearray()
+    scan_from = 0
+    while True:
         data = sock.recv(524288)
         if not data:
-            break
+            return buffer, b""
         buffer += data
-    if delimiter in buffer:
-        header_part, rest = buffer.split(delimiter, 1)
-        return header_part.decode(), rest
-    else:
-        return buffer.decode(), b""
-
-def send_command(server_ip, server_port, command_str="", file_data_bytes=None):
+        # Cari hanya di data baru (mundur sedikit untuk delimiter yang terpotong)
+        idx = buffer.find(delimiter, max(0, scan_from - len(delimiter) + 1))
+        if idx >= 0:
+            return buffer[:idx], memoryview(buffer)[idx + len(delimiter):]
+        scan_from = len(buffer)
+
+def send_header(sock, command_str):
+    """Kirim command string + akhir baris pemisah."""
+    sock.sendall((command_str + "\r\n\r\n").encode())
+
+def recv_response(sock):
+    """Terima header JSON dari server, beserta isi file jika ada filesize."""
+    header_json, rest_data = recv_until(sock)
+
+    response = json_loads(header_json)
+
+    # Jika response OK dan ada filesize, baca sisa file data dari socket
+    if response.get('status') == 'OK':
+        data = response.get('data')
+        if isinstance(data, dict) and 'filesize' in data:
+            filesize = data['filesize']
+            # Buffer dialokasikan sekali sesuai filesize, lalu diisi via recv_into
+            file_data = bytearray(filesize)
+            view = memoryview(file_data)
+            received = min(len(rest_data), filesize)
+            view[:received] = rest_data[:received]
+            # Baca sisa file jika belum lengkap
+            while received < filesize:
+                n = sock.recv_into(view[received:])
+                if not n:
+                    break
+                received += n
+            view.release()
+            del file_data[received:]
+            # Simpan file_data ke response supaya fungsi pemanggil bisa akses
+            response['file_data_bytes'] = file_data
+
+    return response
+
+def open_connection(server_ip, server_port):
+    """Buat socket yang sudah di-tune dan terhubung ke server."""
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
+        tune_socket(sock)
         sock.connect((server_ip, server_port))
+    except Exception:
+        sock.close()
+        raise
+    return sock
 
-        # Kirim command string + akhir baris pemisah
-        sock.sendall((command_str + "\r\n\r\n").encode())
-
-        # Jika ada file_data_bytes, kirim dalam chunk
-        if file_data_bytes:
-            chunk_size = 524288     # 1 mb per chunk
-            total_sent = 0
-            while total_sent < len(file_data_bytes):
-                sent = sock.send(file_data_bytes[total_sent:total_sent + chunk_size])
-                if sent == 0:
-                    raise RuntimeError("Socket connection broken")
-                total_sent += sent
-
-        # Terima header JSON dari server sampai \r\n\r\n
-        header_json_str, rest_data = recv_until(sock)
-
-        response = json.loads(header_json_str.strip())
-
-        # Jika response OK dan ada filesize, baca sisa file data dari socket
-        if response.get('status') == 'OK':
-            data = response.get('data')
-            if isinstance(data, dict) and 'filesize' in data:
-                filesize = data['filesize']
-                file_data = rest_data
-                # Baca sisa file jika belum lengkap
-                while len(file_data) < filesize:
-                    more_data = sock.recv(524288)
-                    if not more_data:
-                        break
-                    file_data += more_data
-                # Simpan file_data ke response supaya fungsi pemanggil bisa akses
-                response['file_data_bytes'] = file_data
-
-        return response
+def send_command(server_ip, server_port, command_str="", file_data_bytes=None):
+    try:
+        with open_connection(server_ip, server_port) as sock:
+            send_header(sock, command_str)
+
+            # Jika ada file_data_bytes, kirim sekaligus; sendall sudah menangani
+            # partial write di C, jadi tidak perlu loop chunk di Python
+            if file_data_bytes:
+                sock.sendall(memoryview(file_data_bytes))
+
+            return recv_response(sock)
 
     except Exception as e:
         logging.error(f"send_command error: {e}")
         return {"status": "ERROR", "data": str(e)}
-    finally:
-        sock.close()
 
-def remote_upload(server_ip, server_port, filepath=""):
+def remote_upload(server_ip, server_port, filepath="", preloaded_bytes=None):
     try:
         filename = os.path.basename(filepath)
+
+        if preloaded_bytes is not None:
+            # Payload sudah dibaca sekali oleh stress_test, tidak perlu buka file lagi
+            command_str = f"UPLOAD {filename} {len(preloaded_bytes)}"
+            return send_command(server_ip, server_port, command_str, preloaded_bytes)
+
         file_size = os.path.getsize(filepath)
 
         # Kirim perintah upload dengan metadata file_size
         command_str = f"UPLOAD {filename} {file_size}"
 
-        with open(filepath, 'rb') as f:
-            file_data_bytes = f.read()
-
-        return send_command(server_ip, server_port, command_str, file_data_bytes)
+        with open(filepath, 'rb') as f, open_connection(server_ip, server_port) as sock:
+            send_header(sock, command_str)
+            # Isi file dikirim kernel langsung (zero-copy), tanpa f.read().
+            # Dibatasi file_size supaya tetap sesuai header walau file bertambah.
+            if file_size > 0:
+                sock.sendfile(f, count=file_size)
+            return recv_response(sock)
 
     except Exception as e:
         logging.error(f"remote_upload error: {e}")
@@ -118,37 +151,77 @@ def remote_download(server_ip, server_port, filename=""):
         logging.error(f"Download failed, status: {result.get('status')}, message: {result.get('data')}")
     return result
 
-def worker_task(server_ip, server_port, operation, filepath):
+def worker_task(server_ip, server_port, operation, filepath, file_size=None, payload=None, shm_name=None):
     start_time = time.time()
     if operation == "upload":
-        result = remote_upload(server_ip, server_port, filepath)
-        byte_size = os.path.getsize(filepath) if result.get('status') == 'OK' else 0
+        # stress_test mengirim ukuran yang sudah dihitung; pemanggil lain fallback ke stat
+        if file_size is None:
+            file_size = os.path.getsize(filepath) if os.path.exists(filepath) else 0
+        if shm_name:
+            # Worker proses: attach ke shared memory yang sudah diisi stress_test
+            shm = shared_memory.SharedMemory(name=shm_name)
+            payload = shm.buf[:file_size]
+            try:
+                result = remote_upload(server_ip, server_port, filepath, preloaded_bytes=payload)
+            finally:
+                payload.release()
+                shm.close()
+        else:
+            result = remote_upload(server_ip, server_port, filepath, preloaded_bytes=payload)
+        byte_size = file_size if result.get('status') == 'OK' else 0
     elif operation == "download":
         result = remote_download(server_ip, server_port, filepath)
-        try:
-            download_path = result.get('download_path')
-            if result.get('status') == 'OK' and download_path and os.path.exists(download_path):
-                byte_size = os.path.getsize(download_path)
-            else:
-                byte_size = 0
-        except Exception as e:
-            logging.error(f"Error getting size of downloaded file: {e}")
-            byte_size = 0
+        # Server sudah mengirim filesize, tidak perlu stat file hasil download
+        byte_size = result.get('data', {}).get('filesize', 0) if result.get('status') == 'OK' else 0
     else:
         result = {"status": "ERROR", "data": "Unknown operation"}
         byte_size = 0
     duration = time.time() - start_time
     return (result.get('status') == 'OK', duration, byte_size)
 
-def stress_test(server_ip, server_port, operation, file_path, pool_mode, pool_size, server_workers, nomor, output_csv):
+def write_csv_row(csvfile, header, row):
+    """Tulis satu baris hasil, header hanya jika file CSV masih kosong."""
+    writer = csv.writer(csvfile)
+    if csvfile.tell() == 0:
+        writer.writerow(header)
+    writer.writerow(row)
+
+def stress_test(server_ip, server_port, operation, file_path, pool_mode, pool_size, server_workers, nomor, output_csv, preload=False):
     executor_cls = ThreadPoolExecutor if pool_mode == "thread" else ProcessPoolExecutor
     results = []
     start_all = time.time()
 
-    with executor_cls(max_workers=pool_size) as executor:
-        futures = [executor.submit(worker_task, server_ip, server_port, operation, file_path) for _ in range(pool_size)]
-        for f in futures:
-            results.append(f.result())
+    file_volume = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+
+    # Dengan preload, file dibaca sekali lalu dibagi ke semua worker.
+    # File yang tidak ada tidak di-preload, biar worker yang melaporkan gagal
+    # seperti jalur tanpa preload.
+    if preload and operation == "upload" and not os.path.isfile(file_path):
+        logging.error(f"Preload skipped, file not found: {file_path}")
+        preload = False
+
+    task_kwargs = {}
+    shm = None
+    try:
+        if preload and operation == "upload":
+            if pool_mode == "thread":
+                with open(file_path, 'rb') as f:
+                    task_kwargs = {"payload": f.read()}
+            else:
+                # Process pool: isi shared memory sekali supaya payload tidak di-pickle ke tiap worker
+                shm = shared_memory.SharedMemory(create=True, size=max(file_volume, 1))
+                with open(file_path, 'rb') as f:
+                    f.readinto(shm.buf[:file_volume])
+                task_kwargs = {"shm_name": shm.name}
+
+        with executor_cls(max_workers=pool_size) as executor:
+            futures = [executor.submit(worker_task, server_ip, server_port, operation, file_path, file_volume, **task_kwargs) for _ in range(pool_size)]
+            for f in as_completed(futures):
+                results.append(f.result())
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
 
     total_worker_time = sum(r[1] for r in results)  # sum durasi per worker
     total_bytes = sum(r[2] for r in results)
@@ -158,27 +231,22 @@ def stress_test(server_ip, server_port, operation, file_path, pool_mode, pool_si
     avg_time_per_client = total_worker_time / pool_size if pool_size > 0 else 0
     throughput_per_client = total_bytes / total_worker_time if total_worker_time > 0 else 0
 
-    file_volume = os.path.getsize(file_path) if os.path.exists(file_path) else 0
-    file_volume_str = f"{round(file_volume / 1024 / 1024)}MB"
-
+    # Simpan angka mentah saja, format (MB, pembulatan) diserahkan ke analisis
     header = [
-        "Nomor", "Operasi", "Volume", "Jumlah client worker pool", "Jumlah server worker pool",
+        "Nomor", "Operasi", "Volume (bytes)", "Jumlah client worker pool", "Jumlah server worker pool",
         "Waktu total per client (s)", "Throughput per client (bytes/s)",
-        "Jumlah worker client yang sukses dan gagal", "Jumlah worker server yang sukses dan gagal"
+        "Jumlah worker client yang sukses", "Jumlah worker client yang gagal",
+        "Jumlah worker server yang sukses", "Jumlah worker server yang gagal"
     ]
     row = [
-        nomor, operation, file_volume_str, pool_size, server_workers,
-        round(avg_time_per_client, 3), round(throughput_per_client, 3),
-        f"{success_count} sukses, {fail_count} gagal",
-        f"{server_workers} server worker, 0 gagal"
+        nomor, operation, file_volume, pool_size, server_workers,
+        avg_time_per_client, throughput_per_client,
+        success_count, fail_count,
+        server_workers, 0
     ]
-    write_header = not os.path.exists(output_csv)
 
     with open(output_csv, mode="a", newline="") as csvfile:
-        writer = csv.writer(csvfile)
-        if write_header:
-            writer.writerow(header)
-        writer.writerow(row)
+        write_csv_row(csvfile, header, row)
 
     print(f"Hasil stress test disimpan ke {output_csv}")
     print("Data:", row)
@@ -194,6 +262,7 @@ def main():
     parser.add_argument("--server_workers", type=int, default=1, help="Number of server workers (for logging only)")
     parser.add_argument("--nomor", type=int, default=1, help="Nomor test case untuk laporan")
     parser.add_argument("--output", default="stress_test_report.csv", help="Output CSV file name")
+    parser.add_argument("--preload", action="store_true", help="Stress test: read the file once and share it across workers")
     args = parser.parse_args()
 
     if args.mode == "upload":
@@ -215,7 +284,7 @@ def main():
         stress_test(
             args.server, args.port, "upload", args.file,
             args.pool_mode, args.pool_size, args.server_workers,
-            args.nomor, args.output
+            args.nomor, args.output, args.preload
         )
 
 if __name__ == "__main__":
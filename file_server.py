@@ -1,90 +1,176 @@
 import socket
 import os
+import re
 import argparse
 import logging
+import logging.handlers
+import atexit
 import json
 import sys
 import threading
-from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import asyncio
+import signal
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+from socket_tuning import tune_socket
+
+try:
+    import orjson   # opsional, encoder C yang langsung menghasilkan bytes
+except ImportError:
+    orjson = None
 
 HOST = '0.0.0.0'
 PORT = 10001
-BUFFER_SIZE = 524288     # 1MB buffer
+BUFFER_SIZE = 524288     # 512KB buffer, bisa diubah via --buffer_size
 STORAGE_DIR = 'storage'
 LOG_FILE = 'server.log'
 
+# Antrian koneksi yang belum di-accept. Kernel memotong nilai ini ke
+# net.core.somaxconn, jadi naikkan juga: sysctl -w net.core.somaxconn=4096
+LISTEN_BACKLOG = 4096
+
+# Buffer BUFFER_SIZE yang dipakai ulang antar koneksi (LIFO supaya buffer
+# yang masih hangat di cache dipakai lebih dulu). Kelebihan dibuang ke GC.
+BUFFER_POOL_SIZE = 64
+buffer_pool = queue.LifoQueue(maxsize=BUFFER_POOL_SIZE)
+
+FILENAME_RE = re.compile(r'^[\w\-.]+\Z')
+
 os.makedirs(STORAGE_DIR, exist_ok=True)
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(threadName)s - %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_FILE),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+# Thread yang melayani client hanya memasukkan record ke antrian; tulis ke
+# server.log dan stdout dikerjakan thread QueueListener di background.
+log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(threadName)s - %(message)s')
+log_handlers = [
+    logging.FileHandler(LOG_FILE),
+    logging.StreamHandler(sys.stdout)
+]
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+
+queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+root_logger = logging.getLogger()
+root_logger.setLevel(logging.INFO)
+root_logger.addHandler(queue_handler)
+
+def start_log_listener():
+    # Antrian baru setiap kali dipanggil: antrian hasil fork masih berisi
+    # record milik parent dan lock internalnya bisa tertahan thread parent
+    queue_handler.queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(queue_handler.queue, *log_handlers)
+    listener.start()
+    return listener
+
+log_listener = start_log_listener()
+atexit.register(log_listener.stop)
+log = logging.getLogger(__name__)
+
+def build_json_response(status, data):
+    payload = {"status": status, "data": data}
+    if orjson is not None:
+        resp = orjson.dumps(payload) + b"\r\n\r\n"
+    else:
+        resp = json.dumps(payload).encode() + b"\r\n\r\n"
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(f"Sending response: status={status}, data={str(data)[:100]}")
+    return resp
 
 def send_json_response(conn, status, data):
-    resp = json.dumps({"status": status, "data": data}) + "\r\n\r\n"
-    logging.debug(f"Sending response: status={status}, data={str(data)[:100]}")
-    conn.sendall(resp.encode())
+    conn.sendall(build_json_response(status, data))
+
+def set_cork(conn, enabled):
+    # TCP_CORK menahan segmen parsial sampai di-uncork, sehingga header JSON
+    # dan awal isi file dikirim dalam paket yang sama
+    if hasattr(socket, "TCP_CORK"):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1 if enabled else 0)
+
+def acquire_buffer():
+    try:
+        return buffer_pool.get_nowait()
+    except queue.Empty:
+        return bytearray(BUFFER_SIZE)
+
+def release_buffer(buf):
+    if len(buf) != BUFFER_SIZE:
+        return
+    try:
+        buffer_pool.put_nowait(buf)
+    except queue.Full:
+        pass
 
 def is_valid_filename(filename):
-    import re
-    valid = re.match(r'^[\w\-.]+$', filename) is not None
-    logging.debug(f"Validating filename '{filename}': {valid}")
+    valid = FILENAME_RE.match(filename) is not None
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(f"Validating filename '{filename}': {valid}")
     return valid
 
+def parse_request(header_data):
+    """Parse 'COMMAND filename filesize', raise ValueError berisi pesan error."""
+    header_text = bytes(header_data).decode(errors='replace')
+    parts = header_text.split()
+    if len(parts) < 3:
+        raise ValueError("Invalid command format")
+
+    command = parts[0].upper()
+    filename = parts[1]
+    if not is_valid_filename(filename):
+        raise ValueError("Invalid filename")
+
+    try:
+        filesize = int(parts[2])
+    except ValueError:
+        raise ValueError("Invalid file size")
+    if filesize < 0:
+        raise ValueError("Invalid file size")
+
+    return command, filename, filesize
+
 def handle_client_raw(conn, addr):
+    # Satu buffer per koneksi dari pool, dipakai untuk header, upload, dan GET
+    buf = acquire_buffer()
+    scratch = memoryview(buf)
     try:
         thread_name = threading.current_thread().name
-        logging.info(f"[{thread_name}] Connection from {addr}")
+        log.info(f"[{thread_name}] Connection from {addr}")
+        tune_socket(conn)
 
-        header_data = b""
+        header_data = bytearray()
         while b"\r\n\r\n" not in header_data:
-            chunk = conn.recv(BUFFER_SIZE)
-            if not chunk:
-                logging.warning(f"[{thread_name}] Client {addr} disconnected before sending full header")
+            n = conn.recv_into(scratch)
+            if not n:
+                log.warning(f"[{thread_name}] Client {addr} disconnected before sending full header")
                 return
-            header_data += chunk
-
-        header_text = header_data.decode(errors='replace').strip()
-        parts = header_text.split()
-        if len(parts) < 3:
-            send_json_response(conn, "ERROR", "Invalid command format")
-            return
-
-        command = parts[0].upper()
-        filename = parts[1]
-        if not is_valid_filename(filename):
-            send_json_response(conn, "ERROR", "Invalid filename")
-            return
+            header_data += scratch[:n]
 
+        # Decode hanya bagian header, bukan payload biner yang ikut terbaca
+        idx = header_data.find(b"\r\n\r\n")
+        header_end = idx + 4
         try:
-            filesize = int(parts[2])
-        except ValueError:
-            send_json_response(conn, "ERROR", "Invalid file size")
+            command, filename, filesize = parse_request(memoryview(header_data)[:idx])
+        except ValueError as e:
+            send_json_response(conn, "ERROR", str(e))
             return
 
         filepath = os.path.join(STORAGE_DIR, filename)
 
         if command == "UPLOAD":
-            header_end = header_data.find(b"\r\n\r\n") + 4
-            file_data = header_data[header_end:]
+            file_data = memoryview(header_data)[header_end:]
             remaining = filesize - len(file_data)
 
             if remaining < 0:
                 send_json_response(conn, "ERROR", "File size smaller than received data")
                 return
 
+            # Terima langsung ke buffer tetap, tanpa alokasi bytes per chunk
             with open(filepath, 'wb') as f:
                 f.write(file_data)
                 while remaining > 0:
-                    chunk = conn.recv(min(BUFFER_SIZE, remaining))
-                    if not chunk:
+                    n = conn.recv_into(scratch, min(BUFFER_SIZE, remaining))
+                    if not n:
                         break
-                    f.write(chunk)
-                    remaining -= len(chunk)
+                    f.write(scratch[:n])
+                    remaining -= n
 
             if remaining > 0:
                 send_json_response(conn, "ERROR", "Incomplete file received")
@@ -97,84 +183,259 @@ def handle_client_raw(conn, addr):
                 return
 
             filesize = os.path.getsize(filepath)
-            send_json_response(conn, "OK", {"filename": filename, "filesize": filesize})
+            set_cork(conn, True)
+            try:
+                send_json_response(conn, "OK", {"filename": filename, "filesize": filesize})
 
-            with open(filepath, 'rb') as f:
-                while True:
-                    chunk = f.read(BUFFER_SIZE)
-                    if not chunk:
-                        break
-                    conn.sendall(chunk)
+                with open(filepath, 'rb') as f:
+                    if hasattr(os, "sendfile"):
+                        # Zero-copy: kernel kirim langsung dari file ke socket
+                        offset = 0
+                        remaining = filesize
+                        while remaining > 0:
+                            sent = os.sendfile(conn.fileno(), f.fileno(), offset, remaining)
+                            if sent == 0:
+                                break
+                            offset += sent
+                            remaining -= sent
+                    else:
+                        while True:
+                            n = f.readinto(scratch)
+                            if not n:
+                                break
+                            conn.sendall(scratch[:n])
+            finally:
+                set_cork(conn, False)
 
         else:
             send_json_response(conn, "ERROR", "Invalid command")
 
     except Exception as e:
-        logging.error(f"Exception handling client {addr}: {e}", exc_info=True)
+        log.error(f"Exception handling client {addr}: {e}", exc_info=True)
         try:
             send_json_response(conn, "ERROR", str(e))
         except:
             pass
     finally:
+        scratch.release()
+        release_buffer(buf)
         conn.close()
-        logging.info(f"Closed connection from {addr}")
+        log.info(f"Closed connection from {addr}")
+
+async def handle_client_async(reader, writer):
+    addr = writer.get_extra_info('peername')
+    try:
+        log.info(f"[async] Connection from {addr}")
+        tune_socket(writer.get_extra_info('socket'))
+
+        # Sama seperti handle_client_raw: data yang ikut terbaca setelah
+        # header dianggap awal isi file, supaya validasi ukuran identik
+        header_data = bytearray()
+        while b"\r\n\r\n" not in header_data:
+            chunk = await reader.read(BUFFER_SIZE)
+            if not chunk:
+                log.warning(f"[async] Client {addr} disconnected before sending full header")
+                return
+            header_data += chunk
+
+        idx = header_data.find(b"\r\n\r\n")
+        header_end = idx + 4
+        try:
+            command, filename, filesize = parse_request(memoryview(header_data)[:idx])
+        except ValueError as e:
+            writer.write(build_json_response("ERROR", str(e)))
+            await writer.drain()
+            return
+
+        filepath = os.path.join(STORAGE_DIR, filename)
+        loop = asyncio.get_running_loop()
+
+        if command == "UPLOAD":
+            file_data = bytes(header_data[header_end:])
+            remaining = filesize - len(file_data)
+
+            if remaining < 0:
+                writer.write(build_json_response("ERROR", "File size smaller than received data"))
+                await writer.drain()
+                return
+
+            # I/O disk dijalankan di thread pool default supaya disk yang
+            # lambat tidak menahan event loop (dan semua client lainnya)
+            f = await loop.run_in_executor(None, open, filepath, 'wb')
+            try:
+                await loop.run_in_executor(None, f.write, file_data)
+                while remaining > 0:
+                    chunk = await reader.read(min(BUFFER_SIZE, remaining))
+                    if not chunk:
+                        break
+                    await loop.run_in_executor(None, f.write, chunk)
+                    remaining -= len(chunk)
+            finally:
+                await loop.run_in_executor(None, f.close)
+
+            if remaining > 0:
+                writer.write(build_json_response("ERROR", "Incomplete file received"))
+            else:
+                writer.write(build_json_response("OK", f"Uploaded {filename}"))
+            await writer.drain()
+
+        elif command == "GET":
+            if not os.path.exists(filepath):
+                writer.write(build_json_response("ERROR", "File not found"))
+                await writer.drain()
+                return
+
+            filesize = os.path.getsize(filepath)
+            sock = writer.get_extra_info('socket')
+            set_cork(sock, True)
+            try:
+                writer.write(build_json_response("OK", {"filename": filename, "filesize": filesize}))
+                await writer.drain()
+
+                # loop.sendfile memakai os.sendfile jika transport mendukung
+                with open(filepath, 'rb') as f:
+                    await loop.sendfile(writer.transport, f)
+            finally:
+                set_cork(sock, False)
+
+        else:
+            writer.write(build_json_response("ERROR", "Invalid command"))
+            await writer.drain()
+
+    except Exception as e:
+        log.error(f"Exception handling client {addr}: {e}", exc_info=True)
+        try:
+            writer.write(build_json_response("ERROR", str(e)))
+            await writer.drain()
+        except:
+            pass
+    finally:
+        writer.close()
+        try:
+            # Tunggu flush terakhir dan tangkap error saat menutup koneksi
+            await writer.wait_closed()
+        except Exception as e:
+            log.warning(f"Error closing connection from {addr}: {e}")
+        log.info(f"Closed connection from {addr}")
 
 def handle_client(conn, addr):
     handle_client_raw(conn, addr)
 
-def start_server_single():
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_socket.bind((HOST, PORT))
-        server_socket.listen()
-        logging.info(f"Single-threaded server started on {HOST}:{PORT}")
-
-        while True:
-            conn, addr = server_socket.accept()
+def create_server_socket():
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind((HOST, PORT))
+    server_socket.listen(LISTEN_BACKLOG)
+    return server_socket
+
+def accept_loop(server_socket, executor=None):
+    while True:
+        conn, addr = server_socket.accept()
+        if executor is None:
             handle_client(conn, addr)
+        else:
+            executor.submit(handle_client, conn, addr)
+
+def start_server_single():
+    with create_server_socket() as server_socket:
+        log.info(f"Single-threaded server started on {HOST}:{PORT}")
+
+        accept_loop(server_socket)
 
 def start_server_threaded(workers):
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_socket.bind((HOST, PORT))
-        server_socket.listen()
-        logging.info(f"Thread-pool server started on {HOST}:{PORT} with {workers} workers")
+    with create_server_socket() as server_socket:
+        log.info(f"Thread-pool server started on {HOST}:{PORT} with {workers} workers")
 
         with ThreadPoolExecutor(max_workers=workers) as executor:
-            while True:
-                conn, addr = server_socket.accept()
-                executor.submit(handle_client, conn, addr)
+            accept_loop(server_socket, executor)
+
+async def serve_async():
+    server = await asyncio.start_server(handle_client_async, HOST, PORT, reuse_address=True, backlog=LISTEN_BACKLOG)
+    log.info(f"Asyncio server started on {HOST}:{PORT}")
+    async with server:
+        await server.serve_forever()
+
+def start_server_async():
+    asyncio.run(serve_async())
 
 def start_server_process(workers):
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_socket.bind((HOST, PORT))
-        server_socket.listen()
-        logging.info(f"Process-pool server started on {HOST}:{PORT} with {workers} workers")
-
-        with ProcessPoolExecutor(max_workers=workers) as executor:
-            while True:
-                conn, addr = server_socket.accept()
-                # NOTE: Connection object cannot be shared across processes.
-                # Workaround: Use multiprocessing queue/pipes or do synchronous fallback
-                # So we handle the connection synchronously in the main process
-                # but you can offload processing-only task to process pool if needed
-                executor.submit(handle_client_raw, conn, addr)
+    with create_server_socket() as server_socket:
+        log.info(f"Pre-fork server started on {HOST}:{PORT} with {workers} worker processes")
+
+        # Pre-fork: socket sudah listen sebelum fork, jadi setiap child
+        # mewarisi socket yang sama dan menjalankan accept loop sendiri.
+        # Satu antrian accept dipakai bersama; koneksi diambil child mana
+        # pun yang sedang menunggu di accept() (tanpa SO_REUSEPORT).
+        # SIGTERM diubah jadi SystemExit supaya blok finally dan atexit jalan:
+        # parent menghentikan semua child, child mem-flush antrian lognya.
+        # Dipasang sebelum fork supaya child ikut mewarisinya. Mode lain
+        # tetap memakai SIGTERM default agar server langsung berhenti.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        children = []
+        for _ in range(workers):
+            pid = os.fork()
+            if pid == 0:
+                # Thread listener tidak ikut ter-fork, child butuh listener sendiri
+                listener = start_log_listener()
+                exit_code = 0
+                try:
+                    accept_loop(server_socket)
+                except (SystemExit, KeyboardInterrupt):
+                    pass
+                except BaseException:
+                    log.exception("Pre-fork worker crashed")
+                    exit_code = 1
+                finally:
+                    listener.stop()
+                    os._exit(exit_code)
+            children.append(pid)
+
+        try:
+            for pid in children:
+                _, status = os.waitpid(pid, 0)
+                exit_code = os.waitstatus_to_exitcode(status)
+                if exit_code != 0:
+                    log.error(f"Pre-fork worker {pid} exited abnormally (exit code {exit_code})")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for pid in children:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+def positive_int(value):
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
 
 def main():
+    global BUFFER_SIZE
     parser = argparse.ArgumentParser(description="File server with multiple concurrency modes.")
-    parser.add_argument('--mode', choices=['single', 'thread', 'process'], default='single', help="Mode to run the server")
-    parser.add_argument('--workers', type=int, default=1, help="Number of worker threads or processes")
+    parser.add_argument('--mode', choices=['single', 'thread', 'process', 'async'], default='single', help="Mode to run the server")
+    parser.add_argument('--workers', type=int, default=1, help="Number of worker threads or processes (ignored in async mode)")
+    parser.add_argument('--buffer_size', type=positive_int, default=BUFFER_SIZE, help="Receive/send chunk size in bytes (power of two recommended)")
+    parser.add_argument('--debug', action='store_true', help="Enable per-request debug logging")
     args = parser.parse_args()
 
+    if args.debug:
+        log.setLevel(logging.DEBUG)
+
+    BUFFER_SIZE = args.buffer_size
+
     if args.mode == 'single':
         start_server_single()
     elif args.mode == 'thread':
         start_server_threaded(args.workers)
     elif args.mode == 'process':
         start_server_process(args.workers)
+    elif args.mode == 'async':
+        start_server_async()
     else:
-        logging.error("Invalid mode selected.")
+        log.error("Invalid mode selected.")
 
 if __name__ == '__main__':
     main()
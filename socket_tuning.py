@@ -0,0 +1,30 @@
+import socket
+
+# Buffer kernel per koneksi. Kernel membatasi nilai ini dengan sysctl
+# net.core.wmem_max / net.core.rmem_max, jadi naikkan keduanya >= 4MB:
+#   sysctl -w net.core.wmem_max=4194304 net.core.rmem_max=4194304
+# SO_SNDBUF / SO_RCVBUF eksplisit mematikan autotuning buffer kernel, jadi
+# masing-masing hanya diset kalau batas sysctl-nya memang sudah dinaikkan.
+# Kalau tidak, nilai yang diminta dipotong ke batas itu dan malah lebih kecil
+# dari hasil autotuning (tcp_wmem / tcp_rmem).
+SOCK_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+def read_sysctl(path, default=0):
+    try:
+        with open(path) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return default
+
+
+WMEM_MAX = read_sysctl('/proc/sys/net/core/wmem_max')
+RMEM_MAX = read_sysctl('/proc/sys/net/core/rmem_max')
+
+
+def tune_socket(sock):
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if WMEM_MAX >= SOCK_BUFFER_SIZE:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCK_BUFFER_SIZE)
+    if RMEM_MAX >= SOCK_BUFFER_SIZE:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCK_BUFFER_SIZE)